@@ -1,18 +1,31 @@
 import ast
-import inspect
+import os
+import sys
 import warnings
+import weakref
+from collections.abc import Callable
 from collections.abc import Iterable
+from collections.abc import Iterator
+from collections.abc import Mapping
+from contextlib import contextmanager
+from contextvars import ContextVar
 from copy import deepcopy
 from dataclasses import dataclass
+from functools import cached_property
 from functools import lru_cache
+from functools import partial
 from types import CodeType
 from types import FrameType
 from typing import Any
 from typing import Optional
+from typing import TYPE_CHECKING
+from typing import TypeVar
 from typing import Union
 
 import executing
 
+T = TypeVar("T")
+
 
 @dataclass
 class FValue:
@@ -22,6 +35,10 @@ class FValue:
     a non-literal string in a concatenation (`+` or `+=`).
     """
 
+    # Equivalent to `@dataclass(slots=True)` which requires Python 3.10.
+    # Saves memory and speeds up attribute access since there are many FValues.
+    __slots__ = ("source", "value", "formatted")
+
     # Python source code of the expression.
     # Doesn't include the format spec or conversion specifier in f-strings,
     # e.g. in `{foo()!r:.2f}` it's just the `foo()`.
@@ -45,11 +62,111 @@ class FValue:
         """
         return self.formatted
 
+    def __getstate__(self) -> dict[str, Any]:
+        # Pickle the same state as before __slots__ were added,
+        # which also makes pickle protocols 0 and 1 work with __slots__.
+        return {name: getattr(self, name) for name in self.__slots__}
+
+    def __setstate__(self, state: Any):
+        # Accept both the state above, which is also what was pickled
+        # before __slots__ were added, and the default (None, slots) state.
+        if isinstance(state, tuple):
+            dict_state, slots_state = state
+            state = {**(dict_state or {}), **(slots_state or {})}
+        for name, value in state.items():
+            setattr(self, name, value)
+
 
 Part = Union[str, FValue]
 Parts = tuple[Part, ...]  # type of F.parts
 
 
+@dataclass(frozen=True)
+class FValueTemplate:
+    """
+    Everything about an FValue that can be determined from the source code alone,
+    i.e. without evaluating anything.
+    """
+
+    # The expression node and the source it came from, used to compute `source`.
+    node: ast.expr
+    ex_source: executing.Source
+
+    # True for expressions in f-strings, which are evaluated by PartsTemplate.code.
+    # Otherwise the value is known at runtime and doesn't need formatting.
+    in_f_string: bool = False
+
+    @cached_property
+    def source(self) -> str:
+        """
+        See FValue.source. Only computed when parts are first built,
+        since many F strings are only ever used as plain strings.
+        """
+        return get_node_source_text(self.node, self.ex_source)
+
+
+PartTemplate = Union[str, FValueTemplate]
+
+
+@dataclass(frozen=True)
+class PartsTemplate:
+    """
+    The parts corresponding to an AST node, with each FValue replaced
+    by an FValueTemplate. Returned by `parts_template`.
+    """
+
+    parts: tuple[PartTemplate, ...]
+
+    # Evaluates all the f-string expressions in `parts` with a single eval(),
+    # returning a flat tuple `(value1, format_spec1, value2, format_spec2, ...)`.
+    # None if there are no such expressions.
+    code: Optional[CodeType]
+
+    # The conversion (`!s`, `!r`, or `!a`) applied to each f-string expression
+    # before formatting, or None if there isn't one.
+    conversions: tuple[Optional[Callable[[Any], str]], ...]
+
+    # True if `parts` contains an FValueTemplate that isn't from an f-string,
+    # i.e. whose value is the runtime value passed to `F._extend_parts`.
+    uses_value: bool
+
+
+# Exact types of FValue.value which don't need to be deep copied.
+# Subclasses (notably F) aren't included since they may contain mutable data.
+# Tuples and frozensets are checked recursively by _is_immutable.
+_immutable_types = frozenset({str, bytes, int, float, complex, bool, type(None)})
+
+
+# See the sanity check in F.__new__.
+_check_parts = __debug__ and os.environ.get("FVALUES_CHECK") != "0"
+
+# Set to False by F.fast_concat().
+_track_concat: ContextVar[bool] = ContextVar("fvalues_track_concat", default=True)
+
+
+def _is_immutable(value: Any) -> bool:
+    """
+    Returns True if `value` and everything it contains can't be mutated,
+    so that it doesn't need to be deep copied.
+    """
+    value_type = type(value)
+    if value_type in _immutable_types:
+        return True
+    if value_type is tuple or value_type is frozenset:
+        return all(_is_immutable(item) for item in value)
+    return False
+
+
+def _deepcopy_value(value: Any, memodict: Optional[dict]) -> Any:
+    """
+    Returns `deepcopy(value, memodict)`,
+    skipping the deepcopy machinery for immutable values.
+    """
+    if _is_immutable(value):
+        return value
+    return deepcopy(value, memodict)
+
+
 class NoSourceAvailableWarning(Warning):
     """
     Indicates that the source code corresponding to an F() call couldn't be found.
@@ -67,76 +184,192 @@ class NoSourceAvailableWarning(Warning):
 class F(str):
     parts: Parts
 
+    # Set instead of `parts` by F() calls until `parts` is first accessed,
+    # see `__getattr__`. Contains the arguments of `_extend_parts`,
+    # i.e. the template, the string passed to F() (only if the template uses it,
+    # otherwise None to avoid keeping a second copy of the string alive),
+    # and the evaluated values and formatted strings of the f-string expressions
+    # as separate lists.
+    # Methods that don't need FValue objects, such as `flatten` and `__deepcopy__`,
+    # work with these directly to avoid building `parts`.
+    _pending: tuple["PartsTemplate", Optional[str], list[Any], list[str]]
+
     def __new__(cls, s: str, parts: Optional[Parts] = None):
         if parts is not None:
             # No magic when parts are provided.
 
-            # Sanity check that the parts add up correctly.
-            expected = "".join(map(str, parts))
-            assert s == expected, f"{s!r} != {expected!r}"
+            # Sanity check that the parts add up correctly,
+            # i.e. the invariant `s == "".join(map(str, parts))`.
+            # This is linear in the length of the string,
+            # so like other assertions it's skipped with `python -O`,
+            # or it can be disabled by setting the environment variable
+            # `FVALUES_CHECK=0`.
+            if _check_parts and not (len(parts) == 1 and parts[0] is s):
+                expected = "".join(
+                    [
+                        part.formatted if isinstance(part, FValue) else str(part)
+                        for part in parts
+                    ]
+                )
+                assert s == expected, f"{s!r} != {expected!r}"
 
             result = super().__new__(cls, s)
             result.parts = parts
             return result
 
-        frame = get_frame()  # frame where F() was called
-        ex = executing.Source.executing(frame)
-        if ex.node is None:
-            warnings.warn(
-                "Couldn't get source node of F() call", NoSourceAvailableWarning
+        frame = sys._getframe(1)  # frame where F() was called
+        try:
+            construct = _f_call_sites[id(frame.f_code), frame.f_lasti]
+        except KeyError:
+            construct = get_f_constructor(frame)
+        return construct(s, frame)
+
+    @classmethod
+    def _build(cls, s: str, parts: Parts) -> "F":
+        """
+        Like `F(s, parts)`, but without the sanity check, for internal callers
+        which build `parts` such that they add up to `s` by construction.
+        """
+        result = str.__new__(cls, s)
+        result.parts = parts
+        return result
+
+    @staticmethod
+    def _from_template(template: PartsTemplate, s: str, frame: FrameType) -> "F":
+        """
+        Construct an F string whose parts correspond to `template`
+        (see `parts_template`) without actually building the parts yet,
+        since many F strings are only ever used as plain strings.
+        The expressions still have to be evaluated immediately
+        since their values may change later.
+        """
+        result = str.__new__(F, s)
+        values, formatted = F._evaluate_template(
+            template, frame.f_globals, frame.f_locals
+        )
+        if template.uses_value:
+            # Fail here rather than when the parts are built, e.g. for F(5).
+            assert isinstance(s, str)
+            value: Optional[str] = s
+        else:
+            value = None
+        result._pending = template, value, values, formatted
+        return result
+
+    if not TYPE_CHECKING:  # so that mypy still checks other attributes
+
+        def __getattr__(self, name: str) -> Any:
+            """
+            Only called when normal attribute lookup fails,
+            i.e. on the first access of `.parts` for a lazily constructed F string.
+            """
+            if name == "parts":
+                # `_pending` is only removed once `parts` is set, so that other
+                # threads never see neither, and a failed build can be retried.
+                pending = self.__dict__.get("_pending")
+                if pending is not None:
+                    parts: list[Part] = []
+                    F._extend_parts(parts, *pending)
+                    self.parts = result = tuple(parts)
+                    self.__dict__.pop("_pending", None)
+                    return result
+                if "parts" in self.__dict__:
+                    # Another thread built the parts since the lookup failed.
+                    return self.__dict__["parts"]
+            raise AttributeError(
+                f"{type(self).__name__!r} object has no attribute {name!r}"
             )
-            return F(s, (s,))
 
-        assert isinstance(ex.node, ast.Call)
+    def __getstate__(self) -> dict[str, Any]:
+        # Build the parts so that they're pickled instead of `_pending`,
+        # which contains code objects.
+        self.parts  # noqa
+        return self.__dict__
 
-        if len(ex.node.args) > 1:
-            return F(s, (s,))  # possible deserialization call
+    def __setstate__(self, state: dict[str, Any]):
+        # Unpickling calls F.__new__ without parts, which sets `_pending`
+        # from wherever pickle.loads was called. The pickled parts replace it.
+        self.__dict__.update(state)
+        self.__dict__.pop("_pending", None)
 
-        [arg] = ex.node.args
-        return F(s, F._parts_from_node(arg, ex, s))
+    @staticmethod
+    def _evaluate_template(
+        template: PartsTemplate, f_globals: dict[str, Any], f_locals: Mapping[str, Any]
+    ) -> tuple[list[Any], list[str]]:
+        """
+        Evaluate the f-string expressions in `template`
+        with the globals and locals of the frame where they're from.
+        Returns a list of the values and a list of the formatted strings.
+        """
+        values: list[Any] = []
+        formatted: list[str] = []
+        if template.code is None:
+            return values, formatted
+        results = iter(eval(template.code, f_globals, f_locals))
+        # Zipping the same iterator twice takes the (value, format_spec) pairs
+        # without slicing `results` into new tuples.
+        for conversion, value, format_spec in zip(
+            template.conversions, results, results
+        ):
+            converted = value if conversion is None else conversion(value)
+            values.append(value)
+            formatted.append(format(converted, format_spec))
+        return values, formatted
 
     @staticmethod
-    def _parts_from_node(
-        node: ast.expr,
-        ex: executing.Executing,
+    def _extend_parts(
+        parts: list[Part],
+        template: PartsTemplate,
         value: Optional[str],
-    ) -> Parts:
+        values: list[Any],
+        formatted: list[str],
+    ):
         """
-        Extract one or more parts (strings or FValues) corresponding to the AST node.
-        `node` should a descendant of `ex.node`.
-        `value` should be the actual runtime value associated with the node if known.
+        Append the parts corresponding to `template` to `parts`,
+        using the results of `_evaluate_template` for f-string FValues.
+        `value` should be the actual runtime value associated with the node
+        that `template` was made from, if that node isn't from an f-string.
         """
-        if isinstance(node, ast.Constant):
-            # Simple literal string part.
-            # Could be a string literal in a concatenation,
-            # or one of JoinedStr (f-string) values that isn't a FormattedValue.
-            assert isinstance(node.value, str)
-            return (node.value,)
-        elif isinstance(node, ast.JoinedStr):  # f-string
-            parts: list[Part] = []
-            for node in node.values:  # ast.Constant or ast.FormattedValue
-                # The values of these nodes are not known,
-                # but don't need to be given here.
-                parts.extend(F._parts_from_node(node, ex, None))
-            return tuple(parts)
-        elif isinstance(node, ast.FormattedValue):
-            source, value_code, formatted_code = compile_formatted_value(
-                node, ex.source
-            )
-            frame = ex.frame
-            value = eval(value_code, frame.f_globals, frame.f_locals)
-            formatted = eval(
-                formatted_code, frame.f_globals, frame.f_locals | {"@fvalue": value}
-            )
-            f_value = FValue(source, value, formatted)
-            return (f_value,)
-        else:
-            assert isinstance(value, str)
-            f_value = FValue(get_node_source_text(node, ex.source), value, value)
-            return (f_value,)
+        i = 0
+        for part in template.parts:
+            if isinstance(part, str):
+                parts.append(part)
+            elif not part.in_f_string:
+                assert isinstance(value, str)
+                parts.append(FValue(part.source, value, value))
+            else:
+                parts.append(FValue(part.source, values[i], formatted[i]))
+                i += 1
 
     def __deepcopy__(self, memodict=None) -> "F":
-        return F(str(self), deepcopy(self.parts, memodict))
+        pending = self.__dict__.get("_pending")
+        if pending is not None:
+            # Only the values need copying, the parts can stay lazy.
+            template, s, values, formatted = pending
+            result = str.__new__(F, self)
+            result._pending = (
+                template,
+                _deepcopy_value(s, memodict),
+                [_deepcopy_value(value, memodict) for value in values],
+                formatted,
+            )
+            return result
+
+        if all(type(part) is str for part in self.parts):
+            # Nothing mutable, so the parts can be shared.
+            return F._build(self, self.parts)
+
+        parts: list[Part] = []
+        for part in self.parts:
+            if type(part) is str:
+                parts.append(part)
+            elif isinstance(part, FValue):
+                # The FValue itself is mutable so it always needs copying.
+                value = _deepcopy_value(part.value, memodict)
+                parts.append(FValue(part.source, value, part.formatted))
+            else:
+                parts.append(deepcopy(part, memodict))
+        return F._build(self, tuple(parts))
 
     def flatten(self) -> "F":
         """
@@ -151,16 +384,45 @@ class F(str):
         with the same `.source` but different values as they were evaluated
         at different times, even for pure expressions like variable names.
         """
-        parts: list[Part] = []
-        for part in self.parts:
-            if isinstance(part, FValue) and isinstance(part.value, F):
-                parts.extend(part.value.flatten().parts)
-            elif isinstance(part, F):
-                # Happens with concatenation when the source node can't be found.
-                parts.extend(part.flatten().parts)
+        pending = self.__dict__.get("_pending")
+        if pending is not None:
+            _template, s, values, _formatted = pending
+            is_flat = not (
+                isinstance(s, F) or any(isinstance(value, F) for value in values)
+            )
+        else:
+            is_flat = not any(
+                isinstance(part, F)
+                or (isinstance(part, FValue) and isinstance(part.value, F))
+                for part in self.parts
+            )
+        if is_flat:
+            # Already flat, and F strings are immutable.
+            return self
+
+        return F._build(self, tuple(self._iter_flat_parts()))
+
+    def _iter_flat_parts(self) -> Iterator[Part]:
+        """
+        Yields the parts of `flatten()`, using an explicit stack of iterators
+        over nested parts rather than recursion so that no intermediate
+        F strings are created, however deeply they're nested.
+        """
+        stack = [iter(self.parts)]
+        while stack:
+            for part in stack[-1]:
+                if isinstance(part, FValue) and isinstance(part.value, F):
+                    stack.append(iter(part.value.parts))
+                    break
+                elif isinstance(part, F):
+                    # Happens with concatenation when the source node can't be found.
+                    stack.append(iter(part.parts))
+                    break
+                else:
+                    yield part
             else:
-                parts.append(part)
-        return F(str(self), tuple(parts))
+                # The innermost iterator is exhausted.
+                stack.pop()
 
     def strip(self, *args) -> "F":
         """
@@ -190,13 +452,16 @@ class F(str):
         Also apply to `.formatted` and maybe `.value` in FValues.
         If the remaining part is empty, remove it and repeat.
         """
-        parts = list(self.parts)
-        while parts:
-            part = parts[index]
+        parts = self.parts
+        step = 1 if index == 0 else -1
+        i = 0 if index == 0 else len(parts) - 1
+        # Skip over parts that become empty, then strip the first one that doesn't.
+        while 0 <= i < len(parts):
+            part = parts[i]
             s = getattr(str(part), method)(*args)
 
             if not s:
-                del parts[index]
+                i += step
                 continue
 
             if isinstance(part, str):
@@ -207,12 +472,19 @@ class F(str):
                     value = getattr(value, method)(*args)
                 part = FValue(part.source, value, s)
 
-            parts[index] = part
+            # Only build a new tuple once, with the stripped edge part.
+            if index == 0:
+                parts = (part,) + parts[i + 1 :]
+            else:
+                parts = parts[:i] + (part,)
             break
+        else:
+            # All parts are empty after stripping.
+            parts = ()
 
         # Strip the string itself.
         s = getattr(super(), method)(*args)
-        return F(s, tuple(parts))
+        return F._build(s, parts)
 
     def _add(self, other: str, is_left: bool) -> "F":
         """
@@ -224,41 +496,60 @@ class F(str):
         then sides that aren't string literals will produce an FValue.
         """
         left, right = (self, other) if is_left else (other, self)
-        value = str(left) + str(right)
-        frame = get_frame().f_back  # get_frame() corresponds to __[r]add__
-        assert frame is not None
-        ex = executing.Source.executing(frame)
-
-        if (
-            ex.node is None
-            and len(ex.statements) == 1
-            and isinstance(stmt := list(ex.statements)[0], ast.AugAssign)
-        ):
-            # Before Python 3.11, `executing` doesn't currently set `.node`
-            # for `+=`. This is easy to workaround because we can just get the
-            # statement as long as there's only one, which is usually the case
-            # i.e. when there's no semicolons.
-            node = stmt
+        if isinstance(other, str):
+            # Concatenate directly rather than copying `self` with `str(self)`.
+            # Calling `str.__add__` avoids recursing into `F.__add__`.
+            value = str.__add__(left, right)
         else:
-            node = ex.node
+            value = str(left) + str(right)
+        if not _track_concat.get():
+            # Inside F.fast_concat().
+            return F._build(value, (left, right))
+
+        # Skip this method and __[r]add__ to get the frame doing the addition.
+        frame = sys._getframe(2)
+        try:
+            templates = _add_call_sites[id(frame.f_code), frame.f_lasti]
+        except KeyError:
+            templates = get_add_templates(frame)
+        if templates is None:
+            # Node couldn't be found or was unexpected type.
+            return F._build(value, (left, right))
 
-        if isinstance(node, (ast.BinOp, ast.AugAssign)) and isinstance(
-            node.op, ast.Add
-        ):
-            if isinstance(node, ast.AugAssign):
-                left_node = node.target
-                right_node = node.value
-            else:
-                left_node = node.left
-                right_node = node.right
-            left_parts = F._parts_from_node(left_node, ex, left)
-            right_parts = F._parts_from_node(right_node, ex, right)
-            parts = left_parts + right_parts
+        # Get the locals once for both sides, and only if they're needed,
+        # since in CPython this copies all the fast locals into a dict.
+        left_template, right_template = templates
+        if left_template.code is None and right_template.code is None:
+            f_locals: Mapping[str, Any] = {}
         else:
-            # Node couldn't be found or was unexpected type.
-            parts = left, right
+            f_locals = frame.f_locals
 
-        return F(value, parts)
+        # Build both sides in one list rather than concatenating tuples.
+        parts: list[Part] = []
+        for template, side in zip(templates, (left, right)):
+            values, formatted = F._evaluate_template(
+                template, frame.f_globals, f_locals
+            )
+            F._extend_parts(parts, template, side, values, formatted)
+        return F._build(value, tuple(parts))
+
+    @staticmethod
+    @contextmanager
+    def fast_concat() -> Iterator[None]:
+        """
+        Context manager which skips detecting the source code of concatenations
+        (`+`, `+=`, and `F.join`) with F strings inside the `with` block.
+        The result of a concatenation then simply has the two sides as its parts,
+        and joining produces the separator and the items as plain parts,
+        the same as when the source code isn't available.
+        Use this in hot code where concatenating F strings is a bottleneck
+        and the sources of the FValues aren't needed.
+        """
+        token = _track_concat.set(False)
+        try:
+            yield
+        finally:
+            _track_concat.reset(token)
 
     def __add__(self, other: str) -> "F":
         return self._add(other, True)
@@ -271,30 +562,27 @@ class F(str):
         to_list = not isinstance(iterable, (list, tuple))
         if to_list:
             iterable = list(iterable)
-        ex = executing.Source.executing(get_frame())
+        sources = None
+        if _track_concat.get():  # i.e. not inside F.fast_concat()
+            frame = sys._getframe(1)
+            try:
+                sources = _join_call_sites[id(frame.f_code), frame.f_lasti]
+            except KeyError:
+                sources = get_join_sources(frame)
         iterable_source = None
         separator_source = None
-        if (
-            ex.node
-            and isinstance(ex.node, ast.Call)
-            and isinstance(ex.node.func, ast.Attribute)
-            and ex.node.func.attr == "join"
-            and len(ex.node.args) == 1
-        ):
-            [iterable_node] = ex.node.args
-            iterable_source = get_node_source_text(iterable_node, ex.source)
+        if sources is not None:
+            iterable_source, separator_source = sources
             iterable_source = f"({iterable_source})"
             if to_list:
                 iterable_source = f"list{iterable_source}"
 
-            separator_node = ex.node.func.value
-            separator_source = get_node_source_text(separator_node, ex.source)
-
+        separator = str(self)
         for i, item in enumerate(iterable):
             assert isinstance(item, str)
             if i:
                 if separator_source:
-                    parts.append(FValue(separator_source, self, str(self)))
+                    parts.append(FValue(separator_source, self, separator))
                 else:
                     parts.append(self)
 
@@ -302,7 +590,9 @@ class F(str):
                 parts.append(FValue(f"{iterable_source}[{i}]", item, str(item)))
             else:
                 parts.append(item)
-        return F(str(self).join(map(str, iterable)), tuple(parts))
+        # str.join accepts str subclasses such as F directly,
+        # computing the total length up front and copying each item once.
+        return F._build(separator.join(iterable), tuple(parts))
 
     def preserved_join(self, iterable: Iterable[str]) -> "F":
         """Join strings while preserving regular strings.
@@ -311,82 +601,321 @@ class F(str):
         to preserve them as regular strings instead of FValues. This function allows
         for that option.
         """
-        joined = ""
         parts = []
         for substring in iterable:
-            joined += substring
             parts.append(substring)
 
             # avoid polluting parts when joining with empty string
-            if str(self) != "":
-                joined += self
+            if self:
                 parts.append(self)
 
-        if len(parts) > 0 and str(self) != "":  # pop the last joiner
-            joined = joined[: -len(self)]
+        if len(parts) > 0 and self:  # pop the last joiner
             parts.pop()
 
-        return F(joined, parts=tuple(parts))
+        # Join once at the end rather than with `+=` in the loop,
+        # which is quadratic and goes through F.__add__ once `self` is added.
+        return F._build("".join(parts), tuple(parts))
 
 
-def get_frame() -> FrameType:
+@dataclass(frozen=True)
+class CallSite:
     """
-    Return the frame which is calling the function which is calling this.
+    The parts of an `executing.Executing` that only depend on the code being run,
+    i.e. not on the frame, so that they can be used to build the
+    call site caches below without keeping the frame alive.
     """
-    return inspect.currentframe().f_back.f_back  # type: ignore
 
+    node: Optional[ast.AST]
+    source: executing.Source
+    statements: set[ast.stmt]
 
-# noinspection PyTypeChecker
-# (PyCharm being weird with AST)
-@lru_cache
-def compile_formatted_value(
-    node: ast.FormattedValue, ex_source: executing.Source
-) -> tuple[str, CodeType, CodeType]:
-    """
-    Returns three things that can be expensive to compute:
-    1. Source code corresponding to the node.
-    2. A compiled code object which can be evaluated to calculate the value.
-    3. Another code object which formats the value.
-    """
-    source = get_node_source_text(node.value, ex_source)
-    value_code = compile(source, "<fvalue1>", "eval")
-    expr = ast.Expression(
-        ast.JoinedStr(
-            values=[
-                # Similar to the original FormattedValue node,
-                # but replace the actual expression with a simple variable lookup.
-                # Use @ in the variable name so that it can't possibly conflict
-                # with a normal variable.
-                # The value of this variable will be provided in the eval() call
-                # and will come from evaluating value_code above.
-                ast.FormattedValue(
-                    value=ast.Name(id="@fvalue", ctx=ast.Load()),
-                    conversion=node.conversion,
-                    format_spec=node.format_spec,
-                )
-            ]
+
+def get_call_site(frame: FrameType) -> CallSite:
+    """
+    Returns the node, source, and statements that `executing` finds for `frame`.
+    These are a pure function of the code object and the current instruction,
+    so everything derived from them is cached per call site by the functions below
+    to avoid calling `executing` repeatedly when the same call site runs many times,
+    e.g. in a loop.
+    """
+    ex = executing.Source.executing(frame)
+    return CallSite(ex.node, ex.source, ex.statements)
+
+
+FConstructor = Callable[[str, FrameType], F]
+
+# Maps (id(code), lasti) of F() calls to a function which constructs the F string
+# from the string and the frame. See _store_for_code.
+_f_call_sites: dict[tuple[int, int], FConstructor] = {}
+
+
+def get_f_constructor(frame: FrameType) -> FConstructor:
+    """
+    Returns a function which constructs the F string
+    for the F() call executing in `frame`.
+    Everything that only depends on the source code is done here once
+    and cached, so that later calls from the same call site only need
+    a dict lookup in F.__new__ before evaluating the FValues.
+    """
+    site = get_call_site(frame)
+    constructor: FConstructor
+    if site.node is None:
+        constructor = _no_source_f
+    else:
+        assert isinstance(site.node, ast.Call)
+        if len(site.node.args) > 1:
+            constructor = _single_part_f  # possible deserialization call
+        else:
+            [arg] = site.node.args
+            template = parts_template(arg, site.source)
+            if len(template.parts) == 1 and isinstance(template.parts[0], str):
+                # A plain string literal, e.g. F("hello") or F(f"hello"),
+                # so there's nothing to evaluate.
+                constructor = _single_part_f
+            else:
+                constructor = partial(F._from_template, template)
+    _store_for_code(_f_call_sites, frame, constructor)
+    return constructor
+
+
+# Like _f_call_sites, but for concatenations with `+` or `+=`,
+# mapping to the templates of the left and right operands,
+# or None if the concatenation node couldn't be found.
+_add_call_sites: dict[
+    tuple[int, int], Optional[tuple[PartsTemplate, PartsTemplate]]
+] = {}
+
+
+def get_add_templates(
+    frame: FrameType,
+) -> Optional[tuple[PartsTemplate, PartsTemplate]]:
+    """
+    Returns the templates of the left and right operands
+    of the concatenation executing in `frame`, and caches them.
+    """
+    site = get_call_site(frame)
+
+    node: Optional[ast.AST]
+    if (
+        site.node is None
+        and len(site.statements) == 1
+        and isinstance(stmt := next(iter(site.statements)), ast.AugAssign)
+    ):
+        # Before Python 3.11, `executing` doesn't currently set `.node`
+        # for `+=`. This is easy to workaround because we can just get the
+        # statement as long as there's only one, which is usually the case
+        # i.e. when there's no semicolons.
+        node = stmt
+    else:
+        node = site.node
+
+    templates = None
+    if isinstance(node, (ast.BinOp, ast.AugAssign)) and isinstance(node.op, ast.Add):
+        if isinstance(node, ast.AugAssign):
+            left_node: ast.expr = node.target
+            right_node = node.value
+        else:
+            left_node = node.left
+            right_node = node.right
+        templates = (
+            parts_template(left_node, site.source),
+            parts_template(right_node, site.source),
+        )
+    _store_for_code(_add_call_sites, frame, templates)
+    return templates
+
+
+# Like _f_call_sites, but for F.join calls, mapping to the source code
+# of the iterable and the separator, or None if the call couldn't be found.
+_join_call_sites: dict[tuple[int, int], Optional[tuple[str, str]]] = {}
+
+
+def get_join_sources(frame: FrameType) -> Optional[tuple[str, str]]:
+    """
+    Returns the source code of the iterable and separator
+    of the F.join call executing in `frame`, and caches them.
+    """
+    site = get_call_site(frame)
+    sources = None
+    if (
+        site.node
+        and isinstance(site.node, ast.Call)
+        and isinstance(site.node.func, ast.Attribute)
+        and site.node.func.attr == "join"
+        and len(site.node.args) == 1
+    ):
+        [iterable_node] = site.node.args
+        separator_node = site.node.func.value
+        sources = (
+            get_node_source_text(iterable_node, site.source),
+            get_node_source_text(separator_node, site.source),
         )
+    _store_for_code(_join_call_sites, frame, sources)
+    return sources
+
+
+def _single_part_f(s: str, _frame: FrameType) -> F:
+    return F._build(s, (s,))
+
+
+def _no_source_f(s: str, _frame: FrameType) -> F:
+    warnings.warn("Couldn't get source node of F() call", NoSourceAvailableWarning)
+    return F._build(s, (s,))
+
+
+def _store_for_code(cache: dict[tuple[int, int], T], frame: FrameType, value: T):
+    """
+    Store `value` in `cache` for the code object and instruction of `frame`.
+    Keying on `id(code)` is cheaper than hashing the code object.
+    The entry is removed when the code object is garbage collected,
+    e.g. code from `exec()` or a reloaded module, which both frees the memory
+    and ensures that the id can't be reused by a different code object
+    while the entry exists.
+    """
+    code = frame.f_code
+    key = id(code), frame.f_lasti
+    cache[key] = value
+    weakref.finalize(code, cache.pop, key, None).atexit = False
+
+
+@lru_cache
+def parts_template(node: ast.expr, ex_source: executing.Source) -> PartsTemplate:
+    """
+    Returns the parts corresponding to the AST node with each FValue replaced
+    by an FValueTemplate, so that the AST only needs to be walked
+    and compiled once per call site.
+    """
+    formatted_values: list[ast.FormattedValue] = []
+    parts = _node_template(node, ex_source, formatted_values)
+    return PartsTemplate(
+        parts,
+        compile_formatted_values(formatted_values) if formatted_values else None,
+        tuple(_conversions[value.conversion] for value in formatted_values),
+        any(
+            isinstance(part, FValueTemplate) and not part.in_f_string for part in parts
+        ),
     )
+
+
+def _node_template(
+    node: ast.expr,
+    ex_source: executing.Source,
+    formatted_values: list[ast.FormattedValue],
+) -> tuple[PartTemplate, ...]:
+    """
+    Returns the part templates for `node`.
+    Appends any f-string FormattedValue nodes to `formatted_values`.
+    """
+    handler = _template_handlers.get(type(node), _expr_template)
+    return handler(node, ex_source, formatted_values)
+
+
+def _constant_template(
+    node: ast.Constant,
+    ex_source: executing.Source,
+    formatted_values: list[ast.FormattedValue],
+) -> tuple[PartTemplate, ...]:
+    # Simple literal string part.
+    # Could be a string literal in a concatenation,
+    # or one of JoinedStr (f-string) values that isn't a FormattedValue.
+    assert isinstance(node.value, str)
+    # Interned so that equal literals from different call sites share memory.
+    # Calls from the same site already share the cached template's string.
+    return (sys.intern(node.value),)
+
+
+def _joined_str_template(
+    node: ast.JoinedStr,
+    ex_source: executing.Source,
+    formatted_values: list[ast.FormattedValue],
+) -> tuple[PartTemplate, ...]:
+    # f-string
+    if len(node.values) == 1 and type(node.values[0]) is ast.Constant:
+        # No braces, e.g. F(f"static message"), so this is a single literal.
+        # Python merges adjacent literals, so there can't be several constants.
+        return _constant_template(node.values[0], ex_source, formatted_values)
+    templates: list[PartTemplate] = []
+    for value in node.values:  # ast.Constant or ast.FormattedValue
+        templates.extend(_node_template(value, ex_source, formatted_values))
+    return tuple(templates)
+
+
+def _formatted_value_template(
+    node: ast.FormattedValue,
+    ex_source: executing.Source,
+    formatted_values: list[ast.FormattedValue],
+) -> tuple[PartTemplate, ...]:
+    formatted_values.append(node)
+    return (FValueTemplate(node.value, ex_source, in_f_string=True),)
+
+
+def _expr_template(
+    node: ast.expr,
+    ex_source: executing.Source,
+    formatted_values: list[ast.FormattedValue],
+) -> tuple[PartTemplate, ...]:
+    # Any other expression, whose value is known at runtime.
+    return (FValueTemplate(node, ex_source),)
+
+
+# Dispatch on the exact node type rather than a chain of isinstance checks.
+_template_handlers: dict[
+    type,
+    Callable[
+        [Any, executing.Source, list[ast.FormattedValue]], tuple[PartTemplate, ...]
+    ],
+] = {
+    ast.Constant: _constant_template,
+    ast.JoinedStr: _joined_str_template,
+    ast.FormattedValue: _formatted_value_template,
+}
+
+# Maps FormattedValue.conversion to the corresponding function.
+_conversions: dict[int, Optional[Callable[[Any], str]]] = {
+    -1: None,
+    ord("s"): str,
+    ord("r"): repr,
+    ord("a"): ascii,
+}
+
+
+# noinspection PyTypeChecker
+# (PyCharm being weird with AST)
+def compile_formatted_values(nodes: list[ast.FormattedValue]) -> CodeType:
+    """
+    Returns a code object which evaluates the expressions
+    and format specs of all the nodes at once.
+    See PartsTemplate.code.
+    """
+    elts: list[ast.expr] = []
+    for node in nodes:
+        elts.append(node.value)
+        # The format spec may itself contain expressions, e.g. `{x:.{n}f}`,
+        # so it's evaluated here too and applied later with format().
+        elts.append(node.format_spec or ast.Constant(""))
+    expr = ast.Expression(ast.Tuple(elts=elts, ctx=ast.Load()))
     ast.fix_missing_locations(expr)
-    formatted_code = compile(expr, "<fvalue2>", "eval")
-    return source, value_code, formatted_code
+    return compile(expr, "<fvalues>", "eval")
 
 
-@lru_cache
-def get_node_source_text(node: ast.AST, ex_source: executing.Source):
+# Bounded so that long-running processes don't accumulate nodes forever.
+# AST nodes hash by identity, so cache hits are cheap.
+@lru_cache(maxsize=4096)
+def get_node_source_text(node: ast.AST, ex_source: executing.Source) -> str:
     """
     Returns some Python source code representing `node`:
     preferably the actual original code given by `ast.get_source_segment`,
     but falling back to `ast.unparse(node)` if the former is incorrect.
     """
-    source_unparsed = ast.unparse(node)
     source_segment = ast.get_source_segment(ex_source.text, node) or ""
+    # The segment is correct if it parses to the same tree as the node,
+    # which is cheaper to check than unparsing the parsed segment.
+    # ast.dump ignores positions, which may differ e.g. in spacing.
     try:
-        source_segment_unparsed = ast.unparse(ast.parse(source_segment, mode="eval"))
+        segment_node = ast.parse(source_segment, mode="eval").body
     except Exception:
-        source_segment_unparsed = ""
-    return (
-        source_segment
-        if source_unparsed == source_segment_unparsed
-        else source_unparsed
-    )
+        same = False
+    else:
+        same = ast.dump(segment_node) == ast.dump(node)
+    # Interned since the same sources (e.g. variable names) tend to repeat.
+    return sys.intern(source_segment if same else ast.unparse(node))
@@ -1,3 +1,6 @@
+import importlib.util
+import pickle
+import sys
 import time
 from copy import deepcopy
 from typing import Any
@@ -5,6 +8,7 @@ from typing import Dict
 
 import pytest
 
+import fvalues.f
 from fvalues import F
 from fvalues import FValue
 from fvalues import NoSourceAvailableWarning
@@ -27,6 +31,22 @@ def test_formatting():
     )
 
 
+def test_conversions():
+    x = "ab"
+    width = 6
+    s = F(f"{x!r:>{width}}|{x!s:^{width}}|{x!a}|{x=}")
+    assert s == "  'ab'|  ab  |'ab'|x='ab'"
+    assert s.parts == (
+        FValue(source="x", value="ab", formatted="  'ab'"),
+        "|",
+        FValue(source="x", value="ab", formatted="  ab  "),
+        "|",
+        FValue(source="x", value="ab", formatted="'ab'"),
+        "|x=",
+        FValue(source="x", value="ab", formatted="'ab'"),
+    )
+
+
 def test_add():
     s = F("hello ") + "world"
     assert s == "hello world"
@@ -74,6 +94,25 @@ def test_add_f():
         "world ",
         FValue(source="3 + 4", value=7, formatted="7"),
     )
+    assert f1.flatten() is f1  # already flat
+
+
+def test_fast_concat():
+    f1 = F("hello ")
+    with F.fast_concat():
+        s = f1 + "world"
+        s += "!"
+    assert s == "hello world!"
+    assert s.parts == (F("hello world", (f1, "world")), "!")
+    assert s.flatten().parts == ("hello ", "world", "!")
+
+    with F.fast_concat():
+        s = F(",").join(["a", "b"])
+    assert s.parts == ("a", ",", "b")
+
+    # Source tracking is restored after the block.
+    s = f1 + "world"
+    assert s.parts[0] == FValue(source="f1", value="hello ", formatted="hello ")
 
 
 def test_no_node():
@@ -168,6 +207,20 @@ def test_strip_flatten():
     assert s.flatten().parts == ("a ", one_fval, "!")
 
 
+def test_flatten_deep():
+    # Deeply nested F strings don't hit the recursion limit.
+    s = F("")
+    for i in range(2000):
+        s += F(f"{i},")
+    assert s.flatten().parts[:4] == (
+        "",
+        FValue(source="i", value=0, formatted="0"),
+        ",",
+        FValue(source="i", value=1, formatted="1"),
+    )
+    assert "".join(map(str, s.flatten().parts)) == s
+
+
 def test_deepcopy():
     name = "world"
     s = F(f"hello {name}")
@@ -175,9 +228,20 @@ def test_deepcopy():
     s = F(f"{s}!")
     assert s == "hello world!"
     check_deepcopy(s)
+    check_deepcopy(s + "?")
+    s.parts  # noqa: build the parts before copying
+    check_deepcopy(s)
 
+    items = [1, 2]
+    pair = (1, "a")
+    s = F(f"{items} {name} {pair}")
+    s2 = check_deepcopy(s)
+    assert s2.parts[0].value is not items  # type: ignore
+    assert s2.parts[2].value is name  # type: ignore
+    assert s2.parts[4].value is pair  # type: ignore
 
-def check_deepcopy(s: F):
+
+def check_deepcopy(s: F) -> F:
     s2 = deepcopy(s)
     assert s == s2
     assert s is not s2
@@ -186,6 +250,7 @@ def check_deepcopy(s: F):
         assert p1 == p2
         if not isinstance(p1, str):
             assert p1 is not p2
+    return s2
 
 
 def test_caching():
@@ -198,6 +263,91 @@ def test_caching():
     assert end - start < 1
 
 
+def test_caching_values():
+    # Check that cached call sites still evaluate the current values.
+    for i in range(3):
+        s = F(f"{i}: {i * 2:03}")
+        assert s == f"{i}: {i * 2:03}"
+        assert s.parts == (
+            FValue(source="i", value=i, formatted=str(i)),
+            ": ",
+            FValue(source="i * 2", value=i * 2, formatted=f"{i * 2:03}"),
+        )
+
+
+def test_reload(tmp_path, monkeypatch):
+    # Call sites are cached per code object, so editing and reloading a module
+    # must produce the parts for the new source.
+    monkeypatch.syspath_prepend(str(tmp_path))
+    monkeypatch.setattr(sys, "dont_write_bytecode", True)
+    path = tmp_path / "fvalues_reload_example.py"
+    path.write_text("from fvalues import F\ndef g(x):\n    return F(f'{x}!')\n")
+    module = importlib.import_module("fvalues_reload_example")
+    assert module.g(1).parts == (FValue(source="x", value=1, formatted="1"), "!")
+
+    path.write_text("from fvalues import F\ndef g(x):\n    return F(f'<{x + 1}>')\n")
+    module = importlib.reload(module)
+    assert module.g(1).parts == (
+        "<",
+        FValue(source="x + 1", value=2, formatted="2"),
+        ">",
+    )
+
+
+def test_lazy_parts():
+    # Parts are built lazily, but values are still captured immediately.
+    x = 1
+    s = F(f"x = {x}")
+    x = 2
+    assert s.parts == ("x = ", FValue(source="x", value=1, formatted="1"))
+    assert x == 2
+
+    s = F(f"x = {x}")
+    s2 = pickle.loads(pickle.dumps(s))
+    assert s2 == s
+    assert s2.parts == ("x = ", FValue(source="x", value=2, formatted="2"))
+    assert deepcopy(s2).parts == s2.parts
+
+    inner = s
+    outer = F(f"<{inner}>")
+    outer2 = pickle.loads(pickle.dumps(outer))
+    assert outer2.flatten().parts == (
+        "<",
+        "x = ",
+        FValue(source="x", value=2, formatted="2"),
+        ">",
+    )
+
+    with pytest.raises(AttributeError):
+        s.foo  # type: ignore
+
+
+def test_pickle_fvalue():
+    v = FValue(source="x", value=1.5, formatted="1.50")
+    for protocol in range(pickle.HIGHEST_PROTOCOL + 1):
+        assert pickle.loads(pickle.dumps(v, protocol)) == v
+
+    # Pickled before FValue had __slots__.
+    old = (
+        b"\x80\x04\x95}\x00\x00\x00\x00\x00\x00\x00\x8c\tfvalues.f\x94\x8c\x01F"
+        b"\x94\x93\x94\x8c\x08x = 1.50\x94\x85\x94\x81\x94}\x94\x8c\x05parts\x94"
+        b"\x8c\x04x = \x94h\x00\x8c\x06FValue\x94\x93\x94)\x81\x94}\x94(\x8c\x06"
+        b"source\x94\x8c\x01x\x94\x8c\x05value\x94G?\xf8\x00\x00\x00\x00\x00\x00"
+        b"\x8c\tformatted\x94\x8c\x041.50\x94ub\x86\x94sb."
+    )
+    s = pickle.loads(old)
+    assert s == "x = 1.50"
+    assert s.parts == ("x = ", v)
+
+
+@pytest.mark.skipif(not __debug__, reason="assertions are disabled")
+def test_non_str_argument():
+    # Non-string arguments fail immediately even though parts are built lazily.
+    x: Any = 123
+    with pytest.raises(AssertionError):
+        F(x)
+
+
 def test_get_source_segment():
     # Check that original source code is typically used.
     s1 = F(f"hello {(1) + 2}")
@@ -211,6 +361,17 @@ def test_get_source_segment():
         FValue(source="1 + (2)", value=3, formatted="3"),
     )
 
+    # Nested code objects must not affect the comparison with the node.
+    n = 3
+    s3 = F(f"{sum(i*2 for i in range(n))} {(lambda q: q+1)(n)} {[i*2 for i in [n]]}")
+    assert s3.parts == (
+        FValue(source="sum(i*2 for i in range(n))", value=6, formatted="6"),
+        " ",
+        FValue(source="(lambda q: q+1)(n)", value=4, formatted="4"),
+        " ",
+        FValue(source="[i*2 for i in [n]]", value=[6], formatted="[6]"),
+    )
+
 
 def test_bad_source_segment():
     s = F(
@@ -331,6 +492,30 @@ def test_preserved_join_empty_string():
     )
 
 
+@pytest.mark.skipif(not fvalues.f._check_parts, reason="parts check is disabled")
+def test_parts_check():
+    with pytest.raises(AssertionError, match="'a' != 'b'"):
+        F("a", ("b",))
+    # Parts other than strings and FValues are converted with str().
+    assert F("1", (1,)) == "1"  # type: ignore
+
+
+def test_parts_check_disabled(monkeypatch):
+    # Load a separate copy of the module rather than reloading fvalues.f,
+    # which would replace the classes used by the other tests.
+    monkeypatch.setenv("FVALUES_CHECK", "0")
+    spec = importlib.util.spec_from_file_location(
+        "fvalues_unchecked", fvalues.f.__file__
+    )
+    assert spec is not None and spec.loader is not None
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    assert not module._check_parts
+    s = module.F("a", ("b",))
+    assert s == "a"
+    assert s.parts == ("b",)
+
+
 def test_deserialization():
     # pyyaml deserialization reconstructs F with multiple arguments:
     # https://github.com/yaml/pyyaml/blob/957ae4d/lib/yaml/constructor.py#L591